@@ -6,6 +6,7 @@ import codecs
 from collections import defaultdict
 import csv
 import datetime
+from functools import partial
 import io
 import logging
 
@@ -15,6 +16,9 @@ from odoo.tools import float_repr, float_is_zero, get_lang
 
 _logger = logging.getLogger(__name__)
 
+# Maximum number of generated records passed to a single _load_records call
+LOAD_RECORDS_BATCH_SIZE = 1000
+
 
 class FecImportWizard(models.TransientModel):
     _inherit = "account.fec.import.wizard"
@@ -26,34 +30,45 @@ class FecImportWizard(models.TransientModel):
     def _generator_fec_res_partner(self, rows, cache):
         """ Import the partners from FEC data files """
 
-        partners_set = set()
+        company_id = self.company_id.id
+        # Refs of the already processed partners, by partner name
+        partners_seen = {}
+        partners = cache["res.partner"]
+        accounts = cache["account.account"]
+
         for record in rows:
             partner_ref = record.get("CompAuxNum", "")
             partner_name = record.get("CompAuxLib", "")
             account_code = record.get("CompteNum", "")
 
             # Check for an existing partner with both the same name and ref
-            if partner_name and (partner_name, partner_ref) not in partners_set:
-                partners_set.add((partner_name, partner_ref))
-
-                # Check if the partner is already existing
-                existing = cache["res.partner"].get(partner_name, None)
-                if not existing or (partner_ref and partner_ref != existing.ref):
-                    data = {
-                        "company_id": self.company_id.id,
-                        "name": partner_name,
-                        "ref": partner_ref,
-                    }
-
-                    # Setup account properties
-                    account = account_code and cache["account.account"].get(account_code.rstrip('0'), None)
-                    if account:
-                        if account.account_type == 'asset_receivable':
-                            data["property_account_receivable_id"] = account.id
-                        elif account.account_type == 'liability_payable':
-                            data["property_account_payable_id"] = account.id
-
-                    yield data
+            if not partner_name:
+                continue
+            partner_refs = partners_seen.get(partner_name)
+            if partner_refs is None:
+                partner_refs = partners_seen[partner_name] = set()
+            elif partner_ref in partner_refs:
+                continue
+            partner_refs.add(partner_ref)
+
+            # Check if the partner is already existing
+            existing = partners.get(partner_name, None)
+            if not existing or (partner_ref and partner_ref != existing.ref):
+                data = {
+                    "company_id": company_id,
+                    "name": partner_name,
+                    "ref": partner_ref,
+                }
+
+                # Setup account properties
+                account = account_code and accounts.get(account_code.rstrip('0'), None)
+                if account:
+                    if account.account_type == 'asset_receivable':
+                        data["property_account_receivable_id"] = account.id
+                    elif account.account_type == 'liability_payable':
+                        data["property_account_payable_id"] = account.id
+
+                yield data
 
     def _generator_fec_account_move(self, rows, cache):
         """ Import the moves from the FEC files.
@@ -67,77 +82,136 @@ class FecImportWizard(models.TransientModel):
 
         moves_dict = {}
 
-        # Keeps track of moves grouped by journal_id and move_date, it helps with imbalances
-        imbalances = defaultdict(lambda: defaultdict(list))
+        # Cached records used on each line
+        accounts = cache["account.account"]
+        partners_ref = cache["res.partner.ref"]
+        currencies = cache["res.currency"]
+        journals = cache["account.journal"]
+        journal_map = cache.get("mapping_journal_code", {})
+        company_id = self.company_id.id
+        company_currency = self.company_id.currency_id
 
         # Keeps the move's balance after summing each line's debit and credit
         balance_dict = {}
 
+        # Keeps each line with its journal_id and move_date, in the file order.
+        # Every line is still recorded since it has to keep its own date, only grouping
+        # them by journal/date into the imbalances is deferred to the imbalanced journals.
+        lines_dates = []
+
+        # Account codes are stripped of their trailing zeros, do it once per distinct code
+        account_keys = {}
+
+        # Amounts repeat a lot among the lines, compute them once per distinct value and currency.
+        # The results of _get_credit_debit_balance are reused for all the lines sharing the same
+        # Debit, Credit, Montant and Sens values and currency: overrides must not depend on anything else.
+        amounts_cache = {}
+
+        # Likewise, _normalize_float_value is only called once per distinct raw Montantdevise value
+        amounts_currency_cache = {}
+
+        # Methods called on each line
+        create_command = fields.Command.create
+
+        # Rounding methods of the currencies, bound once per currency
+        currencies_round = {}
+
+        # Many lines share the same dates, so each distinct date string is parsed only once
+        dates_cache = {}
+
+        def parse_date(value, idx):
+            date = dates_cache.get(value)
+            if date is None:
+                date = value
+                if value:
+                    # FEC dates are always formatted as %Y%m%d, slicing them is much faster than strptime
+                    try:
+                        if len(value) != 8 or not (value.isascii() and value.isdigit()):
+                            raise ValueError(value)
+                        date = datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:]))
+                    except ValueError:
+                        raise UserError(_("Line %s has an invalid date %r", idx, value))
+                dates_cache[value] = date
+            return date
+
         for idx, record in enumerate(rows):
 
+            # The rows are dicts shared with the inherited generators, resolve their getter once per line
+            get = record.get
+
             # Move data -----------------------------------------
 
             # The move_name sometimes may be not provided, use the piece_ref instead
-            piece_ref = record.get("PieceRef", "")
-            ecriture_num = record.get("EcritureNum", "")
+            piece_ref = get("PieceRef", "")
+            ecriture_num = get("EcritureNum", "")
             move_name = ecriture_num or piece_ref
             if not move_name:
                 raise UserError(_("Line %s has an invalid move name", idx))
 
             # The move_date sometimes is not provided, use the piece_date instead
-            piece_date = record.get("PieceDate", "")
-            piece_date = piece_date and datetime.datetime.strptime(piece_date, "%Y%m%d")
-            move_date = record.get("EcritureDate", "")
-            move_date = (move_date and datetime.datetime.strptime(move_date, "%Y%m%d")) or piece_date
-            partner_ref = record.get("CompAuxNum", "")
-            partner_name = record.get("CompAuxLib", "")
-            journal_code = record.get("JournalCode", "")
+            piece_date = get("PieceDate", "")
+            piece_date = parse_date(piece_date, idx)
+            move_date = get("EcritureDate", "")
+            move_date = parse_date(move_date, idx) or piece_date
+            partner_ref = get("CompAuxNum", "")
+            partner_name = get("CompAuxLib", "")
+            journal_code = get("JournalCode", "")
 
             # Move line data ------------------------------------
-            move_line_name = record.get("EcritureLib", "")
-            account_code = record.get("CompteNum", "")
-            currency_name = record.get("Idevise", "")
-            amount_currency = self._normalize_float_value(record, "Montantdevise")
-            matching = record.get("EcritureLet", "")
+            move_line_name = get("EcritureLib", "")
+            account_code = get("CompteNum", "")
+            currency_name = get("Idevise", "")
+            raw_amount_currency = get("Montantdevise")
+            amount_currency = amounts_currency_cache.get(raw_amount_currency)
+            if amount_currency is None:
+                amount_currency = amounts_currency_cache[raw_amount_currency] = self._normalize_float_value(record, "Montantdevise")
+            matching = get("EcritureLet", "")
 
             # Move import --------------------------------------
 
             # Journal
-            journal = cache["account.journal"].get(journal_code, None)
+            journal = journals.get(journal_code, None)
             if not journal:
 
                 # Look for a shortened code
-                journal_code = cache.get("mapping_journal_code", {}).get(journal_code, None)
+                journal_code = journal_map.get(journal_code, None)
                 if journal_code:
-                    journal = cache["account.journal"].get(journal_code, None)
+                    journal = journals.get(journal_code, None)
 
                 if not journal:
                     raise UserError(_("Line %s has an invalid journal code", idx))
 
             # Use the journal and the move_name as key for the move in the moves_dict
-            move_key = "%s/%s" % (journal.code, move_name)
+            move_key = (journal.code, move_name)
 
             # Many move_lines may belong to the same move, the move info gets saved in the moves_dict
-            data = moves_dict.get(move_key, {
-                "company_id": self.company_id.id,
-                "name": move_name,
-                "date": move_date,
-                "ref": piece_ref,
-                "journal_id": journal.id,
-                "line_ids": [],
-            })
-            balance_data = balance_dict.get(move_key, {"balance": 0.0, "matching": False})
+            data = moves_dict.get(move_key)
+            if data is None:
+                data = moves_dict[move_key] = {
+                    "company_id": company_id,
+                    "name": move_name,
+                    "date": move_date,
+                    "ref": piece_ref,
+                    "journal_id": journal.id,
+                    "line_ids": [],
+                }
+            balance_data = balance_dict.get(move_key)
+            if balance_data is None:
+                balance_data = balance_dict[move_key] = {"balance": 0.0, "matching": False}
 
             # Move line import ----------------------------------
 
             # Account
-            account = cache["account.account"].get(account_code.rstrip('0'), None)
+            account_key = account_keys.get(account_code)
+            if account_key is None:
+                account_key = account_keys[account_code] = account_code.rstrip('0')
+            account = accounts.get(account_key, None)
             if not account:
                 raise UserError(_("Line %s has an invalid account %r", idx, account_code))
 
             # Build the basic data
             line_data = {
-                "company_id": self.company_id.id,
+                "company_id": company_id,
                 "name": move_line_name,
                 "ref": piece_ref,
                 "account_id": account.id,
@@ -151,37 +225,42 @@ class FecImportWizard(models.TransientModel):
             # the partner information will stay just on the line.
             # It may be updated in the post-processing after all the imports are done.
             if partner_ref:
-                partner = cache["res.partner.ref"].get(partner_ref, None)
+                partner = partners_ref.get(partner_ref, None)
                 line_data["partner_id"] = partner.id if partner else False
 
             # Currency
-            if currency_name in cache["res.currency"]:
-                currency = cache["res.currency"][currency_name]
+            has_currency = currency_name in currencies
+            if has_currency:
+                currency = currencies[currency_name]
                 line_data.update({
                     "currency_id": currency.id,
                     "amount_currency": amount_currency,
                 })
             else:
-                currency = self.company_id.currency_id
+                currency = company_currency
 
             # Round the values, save the total balance to detect issues
-            credit, debit, balance = self._get_credit_debit_balance(record, currency)
+            currency_id = currency.id
+            amounts_key = (get("Debit"), get("Credit"), get("Montant"), get("Sens"), currency_id)
+            amounts = amounts_cache.get(amounts_key)
+            if amounts is None:
+                amounts = amounts_cache[amounts_key] = self._get_credit_debit_balance(record, currency)
+            credit, debit, balance = amounts
             line_data["credit"] = credit
             line_data["debit"] = debit
-            balance_data["balance"] = currency.round(balance_data["balance"] + balance)
+            currency_round = currencies_round.get(currency_id)
+            if currency_round is None:
+                currency_round = currencies_round[currency_id] = currency.round
+            balance_data["balance"] = currency_round(balance_data["balance"] + balance)
 
             # Montantdevise can be positive while the line is credited:
             # => amount_currency and balance (debit - credit) should always have the same sign
-            if currency_name in cache["res.currency"] and line_data['amount_currency'] * balance < 0:
-                line_data["amount_currency"] *= -1
+            if has_currency and amount_currency * balance < 0:
+                line_data["amount_currency"] = -amount_currency
 
             # Append the move_line data to the move
-            data["line_ids"].append(fields.Command.create(line_data))
-
-            # Update the data in the moves_dict
-            moves_dict[move_key] = data
-            imbalances[journal.id][move_date].append(line_data)
-            balance_dict[move_key] = balance_data
+            data["line_ids"].append(create_command(line_data))
+            lines_dates.append((journal.id, move_date, line_data))
 
         # Check for imbalanced journals, fix rounding issues
         imbalanced_journals = self._check_rounding_issues(moves_dict, balance_dict)
@@ -189,6 +268,13 @@ class FecImportWizard(models.TransientModel):
         # If there are still imbalanced, journals, try to re-group the lines by journal/date,
         # to see if now they balance altogether
         if imbalanced_journals:
+
+            # Keeps track of move lines grouped by journal_id and move_date, it helps with imbalances
+            imbalances = defaultdict(partial(defaultdict, list))
+            for journal_id, move_date, line_data in lines_dates:
+                if journal_id in imbalanced_journals:
+                    imbalances[journal_id][move_date].append(line_data)
+
             self._check_imbalanced_journals(cache, moves_dict, balance_dict, imbalanced_journals, imbalances)
 
         yield from moves_dict.values()
@@ -233,6 +319,11 @@ class FecImportWizard(models.TransientModel):
 
         all_records = {}
         all_templates = self._gather_templates()
+        log_progress = _logger.isEnabledFor(logging.INFO)
+
+        # The file is decoded and parsed only once, then the rows are shared by all the generators.
+        # They can't be fed in a single pass: each model has to be loaded and the cache updated
+        # before the next one is generated (e.g. moves need the imported accounts and journals).
         rows = self._get_rows(self.attachment_id, self.attachment_name)
 
         # For each file provided, cycle over each model
@@ -245,6 +336,7 @@ class FecImportWizard(models.TransientModel):
 
             # Generate the records for the model
             records = []
+            record_ids = []
             generator_name = "_generator_fec_%s" % model.replace(".", "_")
             generator = getattr(self, generator_name)
 
@@ -253,13 +345,20 @@ class FecImportWizard(models.TransientModel):
                 self._apply_template(model_templates, model, record)
                 records.append({"values": record})
 
-                # Notify the user every 100 records
-                if idx and idx % 100 == 0:
+                # Import the records by batches
+                if len(records) >= LOAD_RECORDS_BATCH_SIZE:
+                    record_ids += self.env[model]._load_records(records).ids
+                    records.clear()
+
+                # Notify the user every 1024 records
+                if log_progress and idx and not (idx & 1023):
                     _logger.info("%5d records gathered", idx)
 
-            # Import records, then flush and update the cache with the inserted records
+            # Import the remaining records, then update the cache with all the inserted records
             if records:
-                all_records[model] = self.env[model]._load_records(records)
+                record_ids += self.env[model]._load_records(records).ids
+            if record_ids:
+                all_records[model] = self.env[model].browse(record_ids)
                 self._update_import_cache(cache, model, all_records[model])
 
         # If there are moves, post them